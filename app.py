@@ -11,6 +11,11 @@ import requests
 from datetime import datetime
 import zipfile
 import io
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+from synctex import parse_synctex, find_synctex_file
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'  # Change this to a random secret key
@@ -25,6 +30,11 @@ class LatexCompilerWeb:
         self.pdflatex_path = r'C:\Users\psmsw\AppData\Local\Programs\MiKTeX\miktex\bin\x64\pdflatex.exe'
         self.bibtex_path = r'C:\Users\psmsw\AppData\Local\Programs\MiKTeX\miktex\bin\x64\bibtex.exe'
         self.ollama_url = "http://localhost:11434"  # Default Ollama URL
+        self.synctex_cache = OrderedDict()  # (PDF hash, SyncTeX file state) -> SynctexIndex
+        self.synctex_cache_size = 8
+        self.synctex_lock = threading.Lock()  # Requests are served on several threads
+        self.synctex_building = {}  # cache key -> Event set once its index is built
+        self.pdf_hashes = {}  # PDF path -> (mtime, size, hash)
         
     def get_project_path(self, project_name=None):
         """Get the path for a specific project"""
@@ -207,7 +217,7 @@ For more information, see the comprehensive study by \\cite{sample2024}.
         try:
             # Run pdflatex first time
             result = subprocess.run(
-                [self.pdflatex_path, '-interaction=nonstopmode', main_file],
+                [self.pdflatex_path, '-interaction=nonstopmode', '-synctex=1', main_file],
                 cwd=project_path,
                 check=True,
                 capture_output=True,
@@ -241,13 +251,13 @@ For more information, see the comprehensive study by \\cite{sample2024}.
                 
                 # Run pdflatex again (twice for references to resolve properly)
                 subprocess.run(
-                    [self.pdflatex_path, '-interaction=nonstopmode', main_file],
+                    [self.pdflatex_path, '-interaction=nonstopmode', '-synctex=1', main_file],
                     cwd=project_path,
                     capture_output=True,
                     text=True
                 )
                 subprocess.run(
-                    [self.pdflatex_path, '-interaction=nonstopmode', main_file],
+                    [self.pdflatex_path, '-interaction=nonstopmode', '-synctex=1', main_file],
                     cwd=project_path,
                     capture_output=True,
                     text=True
@@ -268,6 +278,63 @@ For more information, see the comprehensive study by \\cite{sample2024}.
                         error_msg = '\n'.join(error_lines[:5])  # Show first 5 error lines
             return False, None, error_msg
 
+    def get_pdf_hash(self, pdf_path):
+        """Get the SHA-1 of a PDF, only re-hashing it when the file changes"""
+        stat = os.stat(pdf_path)
+        cached = self.pdf_hashes.get(pdf_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        sha1 = hashlib.sha1()
+        with open(pdf_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        self.pdf_hashes[pdf_path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def get_synctex_index(self, project_name, main_file="main.tex"):
+        """Get the SyncTeX index for a compiled project, building it once per PDF"""
+        project_path = self.get_project_path(project_name)
+        pdf_file = os.path.join(project_path, main_file.replace('.tex', '.pdf'))
+        if not os.path.exists(pdf_file):
+            return None
+
+        synctex_file = find_synctex_file(pdf_file)
+        if synctex_file is None:
+            return None
+
+        # pdflatex writes the PDF before renaming the new .synctex into place,
+        # so key on the SyncTeX file too to never pair a PDF with a stale index
+        stat = os.stat(synctex_file)
+        key = (self.get_pdf_hash(pdf_file), synctex_file, stat.st_mtime_ns, stat.st_size)
+
+        while True:
+            with self.synctex_lock:
+                index = self.synctex_cache.get(key)
+                if index is not None:
+                    self.synctex_cache.move_to_end(key)
+                    return index
+                building = self.synctex_building.get(key)
+                if building is None:
+                    building = self.synctex_building[key] = threading.Event()
+                    break
+            # Another request is parsing this file; wait for it and check again
+            building.wait()
+
+        # Parse outside the lock so lookups for other projects are not held up
+        try:
+            index = parse_synctex(synctex_file, project_path)
+            with self.synctex_lock:
+                self.synctex_cache[key] = index
+                while len(self.synctex_cache) > self.synctex_cache_size:
+                    self.synctex_cache.popitem(last=False)
+            return index
+        finally:
+            with self.synctex_lock:
+                del self.synctex_building[key]
+            building.set()
+
     def generate_preview(self, pdf_path):
         """Generate base64 encoded preview image from PDF"""
         try:
@@ -543,6 +610,53 @@ def compile_latex():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/projects/<project_name>/synctex/forward', methods=['GET'])
+def synctex_forward(project_name):
+    """Find the PDF page and box for a source file and line"""
+    main_file = request.args.get('main', 'main.tex')
+    file_path = request.args.get('file', main_file)
+    line = request.args.get('line', type=int)
+    
+    if line is None:
+        return jsonify({'success': False, 'error': 'Line number is required'})
+    
+    try:
+        index = compiler.get_synctex_index(project_name, main_file)
+        if index is None:
+            return jsonify({'success': False, 'error': 'No SyncTeX data found. Please compile the project first'})
+        
+        position = index.forward(file_path, line)
+        if position is None:
+            return jsonify({'success': False, 'error': f'No PDF position found for {file_path}:{line}'})
+        return jsonify({'success': True, **position})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/projects/<project_name>/synctex/inverse', methods=['GET'])
+def synctex_inverse(project_name):
+    """Find the source file and line for a point on a PDF page"""
+    main_file = request.args.get('main', 'main.tex')
+    page = request.args.get('page', type=int)
+    x = request.args.get('x', type=float)
+    y = request.args.get('y', type=float)
+    
+    if page is None or x is None or y is None:
+        return jsonify({'success': False, 'error': 'Page, x and y are required'})
+    if page < 1 or not all(math.isfinite(v) and v >= 0 for v in (x, y)):
+        return jsonify({'success': False, 'error': 'Page must be positive and x, y finite and non-negative'})
+    
+    try:
+        index = compiler.get_synctex_index(project_name, main_file)
+        if index is None:
+            return jsonify({'success': False, 'error': 'No SyncTeX data found. Please compile the project first'})
+        
+        position = index.inverse(page, x, y)
+        if position is None:
+            return jsonify({'success': False, 'error': f'No source position found on page {page}'})
+        return jsonify({'success': True, **position})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/download/<project_name>/<file_name>')
 def download_pdf(project_name, file_name):
     """Download the compiled PDF"""
@@ -0,0 +1,332 @@
+"""SyncTeX parsing and source <-> PDF position lookup"""
+import array
+import bisect
+import gzip
+import math
+import os
+
+# SyncTeX stores positions in TeX scaled points; PDF coordinates are big points
+SP_PER_BP = 65781.76
+# Height (in PDF points) of the horizontal bands used for inverse lookups
+BAND_HEIGHT = 16.0
+# How many bands above and below to search when nothing is on the clicked band
+MAX_BAND_SEARCH = 8
+# Largest value that fits in the low half of a packed 64-bit key
+MAX_KEY_PART = 0xFFFFFFFF
+# No real record is taller than this many bands; guards against malformed files
+MAX_BANDS_PER_RECORD = 4096
+
+KIND_BOX = 0    # hbox / void hbox: has a real width and height
+KIND_POINT = 1  # glue, kern, math and "current" records: a single position
+
+
+class SynctexIndex:
+    """Array-backed spatial index over the records of one .synctex file.
+
+    Only horizontal boxes and point records are kept; vertical boxes usually
+    span a whole page and carry no useful position information. Coordinates
+    are PDF points measured from the top-left corner of the page, which is
+    what PyMuPDF uses as well.
+    """
+
+    def __init__(self, base_dir=None):
+        self.base_dir = base_dir
+        self.inputs = {}  # tag -> file name (relative to base_dir when possible)
+
+        self.page = array.array('i')
+        self.tag = array.array('i')
+        self.line = array.array('i')
+        self.kind = array.array('b')
+        self.x0 = array.array('d')
+        self.y0 = array.array('d')
+        self.x1 = array.array('d')
+        self.y1 = array.array('d')
+
+        # Forward index: (tag << 32 | line) sorted, with parallel record ids
+        self.forward_keys = array.array('q')
+        self.forward_records = array.array('i')
+        # Inverse index: (page << 32 | band) sorted, with parallel record ids
+        self.band_keys = array.array('q')
+        self.band_records = array.array('i')
+
+    def __len__(self):
+        return len(self.page)
+
+    def add_input(self, tag, file_name):
+        """Register the source file behind a SyncTeX input tag"""
+        file_name = os.path.normpath(file_name)
+        if self.base_dir and os.path.isabs(file_name):
+            base = os.path.abspath(self.base_dir)
+            if os.path.commonpath([base, file_name]) == base:
+                file_name = os.path.relpath(file_name, base)
+        self.inputs[tag] = file_name.replace(os.sep, '/')
+
+    def add_record(self, page, tag, line, kind, x0, y0, x1, y1):
+        """Append a record (x0 <= x1, y0 <= y1); call build() once done"""
+        self.page.append(page)
+        self.tag.append(tag)
+        self.line.append(line)
+        self.kind.append(kind)
+        self.x0.append(x0)
+        self.y0.append(y0)
+        self.x1.append(x1)
+        self.y1.append(y1)
+
+    def build(self):
+        """Sort the records into the forward and inverse lookup arrays"""
+        # Sort by (tag, line, page, record) packed into one integer per record;
+        # values from a malformed file are clamped so they cannot spill over
+        packed = sorted((((_clamp(tag, 0x7FFFFFFF) << 32 | _clamp(line, MAX_KEY_PART)) << 24
+                          | _clamp(page, 0xFFFFFF)) << 32) | i
+                        for i, (tag, line, page) in enumerate(zip(self.tag, self.line, self.page)))
+        self.forward_keys = array.array('q', [key >> 56 for key in packed])
+        self.forward_records = array.array('i', [key & 0xFFFFFFFF for key in packed])
+
+        bands = []
+        for i, (page, y0, y1) in enumerate(zip(self.page, self.y0, self.y1)):
+            if page < 0 or not (math.isfinite(y0) and math.isfinite(y1)):
+                continue
+            first = _clamp(int(y0 // BAND_HEIGHT), MAX_KEY_PART)
+            last = min(_clamp(int(y1 // BAND_HEIGHT), MAX_KEY_PART), first + MAX_BANDS_PER_RECORD)
+            key = (page << 32 | first) << 32
+            if first == last:
+                bands.append(key | i)
+            else:
+                bands.extend(((page << 32 | band) << 32) | i for band in range(first, last + 1))
+        bands.sort()
+        self.band_keys = array.array('q', [key >> 32 for key in bands])
+        self.band_records = array.array('i', [key & 0xFFFFFFFF for key in bands])
+        return self
+
+    def find_tag(self, file_name):
+        """Return the input tag for a source file name, or None"""
+        wanted = os.path.normpath(file_name).replace(os.sep, '/')
+        for tag, name in self.inputs.items():
+            if name == wanted:
+                return tag
+        suffix = '/' + wanted
+        for tag, name in self.inputs.items():
+            if name.endswith(suffix):
+                return tag
+        return None
+
+    def forward(self, file_name, line):
+        """Map a source position to the page and box it was typeset in.
+
+        If nothing was recorded for the exact line, the nearest following
+        line is used (falling back to the nearest preceding one).
+        """
+        tag = self.find_tag(file_name)
+        if tag is None:
+            return None
+
+        keys = self.forward_keys
+        start = bisect.bisect_left(keys, (tag << 32) | _clamp(line, MAX_KEY_PART))
+        if start == len(keys) or keys[start] >> 32 != tag:
+            if start == 0 or keys[start - 1] >> 32 != tag:
+                return None
+            start = bisect.bisect_left(keys, keys[start - 1])
+        end = bisect.bisect_right(keys, keys[start])
+
+        records = self.forward_records
+        page = self.page[records[start]]
+        x0 = y0 = float('inf')
+        x1 = y1 = float('-inf')
+        for pos in range(start, end):
+            i = records[pos]
+            if self.page[i] != page:
+                break
+            x0 = min(x0, self.x0[i])
+            y0 = min(y0, self.y0[i])
+            x1 = max(x1, self.x1[i])
+            y1 = max(y1, self.y1[i])
+
+        return {
+            'page': page,
+            'line': keys[start] & 0xFFFFFFFF,
+            'x': x0,
+            'y': y0,
+            'width': x1 - x0,
+            'height': y1 - y0,
+        }
+
+    def inverse(self, page, x, y):
+        """Map a point on a PDF page to the source file and line behind it"""
+        if page < 1 or not (math.isfinite(x) and math.isfinite(y)):
+            return None
+        band = int(y // BAND_HEIGHT)
+        if band > MAX_KEY_PART:
+            return None
+        best = self._closest_in_band(page, band, x, y)
+        # Widen the search while a neighbouring band could still hold a record
+        # closer to the click than the best one found so far
+        above = y - band * BAND_HEIGHT
+        below = (band + 1) * BAND_HEIGHT - y
+        for offset in range(1, MAX_BAND_SEARCH + 1):
+            reach = (offset - 1) * BAND_HEIGHT
+            if best is not None and min(above, below) + reach > best[0][0]:
+                break
+            for candidate_band, gap in ((band - offset, above), (band + offset, below)):
+                if best is not None and gap + reach > best[0][0]:
+                    continue
+                found = self._closest_in_band(page, candidate_band, x, y)
+                if found is not None and (best is None or found[0] < best[0]):
+                    best = found
+        if best is None:
+            return None
+
+        i = best[1]
+        return {
+            'file': self.inputs.get(self.tag[i]),
+            'line': self.line[i],
+            'page': page,
+        }
+
+    def _closest_in_band(self, page, band, x, y):
+        """Return (rank, record) for the record in a band nearest to (x, y)"""
+        if band < 0 or band > MAX_KEY_PART:
+            return None
+        key = (page << 32) | band
+        start = bisect.bisect_left(self.band_keys, key)
+        end = bisect.bisect_right(self.band_keys, key, start)
+
+        best = None
+        for pos in range(start, end):
+            i = self.band_records[pos]
+            dy = max(self.y0[i] - y, 0.0, y - self.y1[i])
+            dx = max(self.x0[i] - x, 0.0, x - self.x1[i])
+            # Prefer the clicked line, then the nearest point record: the hbox of
+            # a paragraph line carries the line the paragraph ended on, not the
+            # line its words came from. Enclosing boxes are only a fallback.
+            rank = (dy, self.kind[i] != KIND_POINT, dx, self.x1[i] - self.x0[i])
+            if best is None or rank < best[0]:
+                best = (rank, i)
+        return best
+
+
+def _clamp(value, high):
+    return min(max(value, 0), high)
+
+
+def _fits_int(value):
+    """Whether a value fits the 32-bit integer arrays of a SynctexIndex"""
+    return -0x80000000 <= value <= 0x7FFFFFFF
+
+
+def _open_synctex(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def find_synctex_file(pdf_path):
+    """Return the SyncTeX file written next to a PDF, or None"""
+    stem = os.path.splitext(pdf_path)[0]
+    for candidate in (stem + '.synctex.gz', stem + '.synctex'):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def parse_synctex(path, base_dir=None):
+    """Parse a (optionally gzipped) .synctex file into a SynctexIndex"""
+    index = SynctexIndex(base_dir)
+    unit = 1.0
+    magnification = 1000.0
+    x_offset = y_offset = 0.0
+    in_content = False
+    page = 0
+    # Vertical extent of each enclosing hbox, or None for vboxes
+    stack = []
+    add_record = index.add_record
+
+    with _open_synctex(path) as f:
+        for raw in f:
+            raw = raw.rstrip('\r\n')
+            if not raw:
+                continue
+
+            if raw.startswith('Input:'):
+                tag, _, name = raw[6:].partition(':')
+                try:
+                    index.add_input(int(tag), name)
+                except ValueError:
+                    pass
+                continue
+
+            if not in_content:
+                key, _, value = raw.partition(':')
+                try:
+                    if key == 'Unit':
+                        unit = float(value)
+                    elif key == 'Magnification':
+                        magnification = float(value)
+                    elif key == 'X Offset':
+                        x_offset = float(value)
+                    elif key == 'Y Offset':
+                        y_offset = float(value)
+                except ValueError:
+                    pass
+                if key == 'Content':
+                    in_content = True
+                    scale = unit * magnification / 1000.0 / SP_PER_BP
+                    # Like the reference parser, offsets ignore the magnification
+                    x_offset *= unit / SP_PER_BP
+                    y_offset *= unit / SP_PER_BP
+                continue
+
+            kind = raw[0]
+            if kind == '{' or kind == '}':
+                try:
+                    page = int(raw[1:])
+                except ValueError:
+                    pass
+                else:
+                    # Records on a page that cannot be stored are skipped
+                    if not _fits_int(page):
+                        page = None
+                stack = []
+                continue
+            if kind == ']' or kind == ')':
+                if stack:
+                    stack.pop()
+                continue
+            if kind == '[':
+                stack.append(None)
+                continue
+            if kind not in '(hxkg$':
+                # Page boundaries, byte offsets ('!'), vboxes ('v') and the postamble
+                if raw.startswith('Postamble:'):
+                    break
+                continue
+
+            try:
+                fields = raw[1:].split(':')
+                link = fields[0].split(',')
+                tag, line = int(link[0]), int(link[1])
+                if page is None or not (_fits_int(tag) and _fits_int(line)):
+                    raise ValueError('SyncTeX record out of range')
+                h, v = fields[1].split(',')[:2]
+                h = int(h) * scale + x_offset
+                v = int(v) * scale + y_offset
+                if kind == '(' or kind == 'h':
+                    width, height, depth = (int(n) * scale for n in fields[2].split(',')[:3])
+                    top, bottom = v - height, v + depth
+                    if kind == '(':
+                        stack.append((top, bottom))
+                    if width < 0:
+                        add_record(page, tag, line, KIND_BOX, h + width, top, h, bottom)
+                    else:
+                        add_record(page, tag, line, KIND_BOX, h, top, h + width, bottom)
+                    continue
+            except (ValueError, IndexError, OverflowError):
+                if kind == '(':
+                    stack.append(None)
+                continue
+
+            # Point records take the height of the line they sit on
+            extent = stack[-1] if stack else None
+            top, bottom = extent if extent is not None else (v, v)
+            add_record(page, tag, line, KIND_POINT, h, top, h, bottom)
+
+    return index.build()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make the top-level modules (app, synctex) importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
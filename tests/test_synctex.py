@@ -0,0 +1,244 @@
+import gzip
+import os
+import shutil
+import threading
+
+import pytest
+
+from synctex import KIND_BOX, KIND_POINT, SP_PER_BP, SynctexIndex, parse_synctex
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'sample.synctex')
+
+
+@pytest.fixture(scope='module')
+def index():
+    return parse_synctex(FIXTURE)
+
+
+def test_inverse_prefers_point_records_over_paragraph_hbox(index):
+    # Both paragraph lines are hboxes tagged with the paragraph's last line (12)
+    assert index.inverse(1, 200, 95)['line'] == 11
+    assert index.inverse(1, 101, 98)['line'] == 10
+    assert index.inverse(1, 105, 110)['line'] == 11
+    assert index.inverse(1, 290, 110)['line'] == 12
+
+
+def test_out_of_range_positions_do_not_spill_into_other_keys(index):
+    assert index.inverse(1, 100, 16 * 2 ** 32 + 1) is None
+    assert index.inverse(1, float('nan'), 100) is None
+    assert index.inverse(1, 100, float('inf')) is None
+    assert index.inverse(0, 100, 100) is None
+    # A huge line must stay within main.tex instead of reaching chapters/intro.tex
+    assert index.forward('main.tex', 2 ** 32 + 5)['page'] == 1
+    assert index.forward('main.tex', -3)['line'] == 10
+
+
+def test_build_clamps_malformed_lines():
+    index = SynctexIndex()
+    index.add_input(1, 'main.tex')
+    index.add_input(2, 'other.tex')
+    index.add_record(1, 1, -1, KIND_BOX, 0, 0, 10, 10)
+    index.add_record(2, 1, 7, KIND_BOX, 0, 0, 10, 10)
+    index.add_record(3, 2, 1, KIND_BOX, 0, 0, 10, 10)
+    index.build()
+    assert index.forward('main.tex', 7)['page'] == 2
+    assert index.forward('other.tex', 1)['page'] == 3
+
+
+def test_out_of_range_integers_in_file_are_skipped(tmp_path):
+    path = tmp_path / 'overflow.synctex'
+    path.write_text('\n'.join([
+        'SyncTeX Version:1',
+        'Input:1:./main.tex',
+        'Content:',
+        '{99999999999',
+        'h1,2:100,100:100,100,0',
+        '}99999999999',
+        '{1',
+        'h1,99999999999:100,100:100,100,0',
+        'h99999999999,3:100,100:100,100,0',
+        'x1,4:%s,100' % ('9' * 400),
+        'h1,5:100,100:100,100,0',
+        '}1',
+    ]) + '\n')
+
+    index = parse_synctex(str(path))
+    assert len(index) == 1
+    assert index.forward('main.tex', 1)['line'] == 5
+
+
+@pytest.mark.parametrize('magnification, x, y, width', [
+    (1000, 40, 100, 20),
+    # Magnification scales positions and sizes but not the header offsets
+    (2000, 60, 180, 40),
+])
+def test_header_unit_scales_offsets_and_positions(tmp_path, magnification, x, y, width):
+    ten_bp = round(10 * SP_PER_BP)
+    path = tmp_path / 'unit.synctex'
+    path.write_text('\n'.join([
+        'SyncTeX Version:1',
+        'Input:1:./main.tex',
+        'Magnification:%d' % magnification,
+        'Unit:2',
+        'X Offset:%d' % ten_bp,
+        'Y Offset:%d' % ten_bp,
+        'Content:',
+        '{1',
+        'h1,3:%d,%d:%d,%d,0' % (ten_bp, 5 * ten_bp, ten_bp, ten_bp),
+        '}1',
+    ]) + '\n')
+
+    position = parse_synctex(str(path)).forward('main.tex', 3)
+    assert position['x'] == pytest.approx(x, abs=0.01)
+    assert position['y'] == pytest.approx(y, abs=0.01)
+    assert position['width'] == pytest.approx(width, abs=0.01)
+
+
+def test_gzipped_file_matches_plain(tmp_path, index):
+    gz_path = tmp_path / 'main.synctex.gz'
+    with open(FIXTURE, 'rb') as src, gzip.open(gz_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    assert len(parse_synctex(str(gz_path))) == len(index)
+
+
+def test_inputs_declared_mid_content(index):
+    assert index.inputs == {1: 'main.tex', 2: 'chapters/intro.tex'}
+    assert index.forward('chapters/intro.tex', 5)['page'] == 2
+    assert index.forward('intro.tex', 5)['page'] == 2
+    assert index.inverse(2, 101, 98) == {'file': 'chapters/intro.tex', 'line': 5, 'page': 2}
+
+
+def test_nested_boxes_restore_enclosing_line_extent(index):
+    # The glue after the inner vbox closes sits on the outer hbox's line
+    assert index.inverse(1, 300, 195)['line'] == 22
+    assert index.inverse(1, 91, 195)['line'] == 21
+
+
+def test_negative_width_hbox(index):
+    position = index.forward('main.tex', 30)
+    assert position['x'] == pytest.approx(300, abs=0.01)
+    assert position['width'] == pytest.approx(100, abs=0.01)
+    assert index.inverse(1, 350, 295)['line'] == 30
+
+
+def test_forward_falls_back_to_next_then_previous_line(index):
+    assert index.forward('main.tex', 3)['line'] == 10
+    assert index.forward('main.tex', 25)['line'] == 30
+    assert index.forward('main.tex', 99)['line'] == 30
+    assert index.forward('chapters/intro.tex', 50)['line'] == 5
+    assert index.forward('missing.tex', 1) is None
+
+
+def test_forward_returns_box_on_first_page(index):
+    position = index.forward('main.tex', 11)
+    assert position['page'] == 1
+    assert position['x'] == pytest.approx(100, abs=0.01)
+    assert position['y'] == pytest.approx(90, abs=0.01)
+    assert position['width'] == pytest.approx(100, abs=0.01)
+    assert position['height'] == pytest.approx(27, abs=0.01)
+
+
+def test_inverse_spills_over_into_nearby_bands(index):
+    # Nothing on the clicked band; the nearest record is a few bands up
+    assert index.inverse(2, 100, 160)['line'] == 5
+    # Too far from any record
+    assert index.inverse(2, 100, 400) is None
+
+
+def test_inverse_checks_closer_record_across_band_boundary():
+    index = SynctexIndex()
+    index.add_input(1, 'main.tex')
+    index.add_record(1, 1, 5, KIND_POINT, 100, 2, 100, 14)
+    index.add_record(1, 1, 6, KIND_POINT, 100, 16.3, 100, 28)
+    index.build()
+    assert index.inverse(1, 100, 15.9)['line'] == 6
+    assert index.inverse(1, 100, 14.5)['line'] == 5
+    assert index.inverse(1, 100, 16.1)['line'] == 6
+    assert index.inverse(1, 100, 1.0)['line'] == 5
+
+
+@pytest.fixture
+def web_app(tmp_path, monkeypatch):
+    pytest.importorskip('flask')
+    pytest.importorskip('fitz')
+    # Importing app creates its projects/ and output/ folders in the cwd
+    monkeypatch.chdir(tmp_path)
+    import app
+
+    project_path = tmp_path / 'demo'
+    project_path.mkdir()
+    (project_path / 'main.pdf').write_bytes(b'%PDF-1.4 test')
+    shutil.copy(FIXTURE, project_path / 'main.synctex')
+    monkeypatch.setattr(app.compiler, 'base_dir', str(tmp_path))
+    monkeypatch.setattr(app.compiler, 'synctex_cache', type(app.compiler.synctex_cache)())
+    return app
+
+
+def test_endpoints(web_app):
+    client = web_app.app.test_client()
+
+    response = client.get('/api/projects/demo/synctex/forward?file=main.tex&line=11').get_json()
+    assert response['success'] and response['page'] == 1 and response['line'] == 11
+
+    response = client.get('/api/projects/demo/synctex/inverse?page=1&x=200&y=95').get_json()
+    assert response == {'success': True, 'file': 'main.tex', 'line': 11, 'page': 1}
+
+    response = client.get('/api/projects/demo/synctex/inverse?page=1&x=200&y=-1').get_json()
+    assert not response['success']
+    response = client.get('/api/projects/demo/synctex/forward?file=main.tex').get_json()
+    assert not response['success']
+    response = client.get('/api/projects/missing/synctex/forward?line=1').get_json()
+    assert not response['success']
+
+
+def test_index_is_rebuilt_when_synctex_file_changes(web_app, tmp_path):
+    compiler = web_app.compiler
+    first = compiler.get_synctex_index('demo')
+    assert compiler.get_synctex_index('demo') is first
+
+    # Same PDF, but pdflatex has since moved a new SyncTeX file into place
+    synctex_file = tmp_path / 'demo' / 'main.synctex'
+    synctex_file.write_text(synctex_file.read_text().replace('Input:1:./main.tex', 'Input:1:./body.tex'))
+    stat = os.stat(synctex_file)
+    os.utime(synctex_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    second = compiler.get_synctex_index('demo')
+    assert second is not first
+    assert second.inputs[1] == 'body.tex'
+
+
+def test_parse_runs_once_and_outside_the_cache_lock(web_app, tmp_path, monkeypatch):
+    compiler = web_app.compiler
+    cached = compiler.get_synctex_index('demo')
+    shutil.copytree(tmp_path / 'demo', tmp_path / 'other')
+
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_parse(path, base_dir=None):
+        calls.append(path)
+        started.set()
+        release.wait(5)
+        return parse_synctex(path, base_dir)
+
+    monkeypatch.setattr(web_app, 'parse_synctex', slow_parse)
+    results = []
+    builders = [threading.Thread(target=lambda: results.append(compiler.get_synctex_index('other')))
+                for _ in range(2)]
+    for thread in builders:
+        thread.start()
+    assert started.wait(5)
+
+    # A cache hit for another project must not wait for the parse
+    hit = []
+    lookup = threading.Thread(target=lambda: hit.append(compiler.get_synctex_index('demo')))
+    lookup.start()
+    lookup.join(2)
+    assert hit == [cached]
+
+    release.set()
+    for thread in builders:
+        thread.join(5)
+    assert len(calls) == 1
+    assert len(results) == 2 and results[0] is results[1]